@@ -1,26 +1,61 @@
 
-from typing import Optional, List, Dict, Any
-from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import suppress
 import gzip
-import glob
 import os
+import re
+import fcntl
+import shlex
 import sys
 import signal
 import logging
+import logging.handlers
+import atexit
 import subprocess
 import configparser
 import time
-import psutil
 import shutil
 import datetime
 monitoring = None
+_LOG_FORMATTER = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_PID_DIR = '/tmp/'
+_FILE_TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+_PATH_NAME_TABLE = str.maketrans('/\\', '--')
+_RSYNC_STATUS_RE = re.compile(rb'failed|complete', re.IGNORECASE)
+_RSYNC_STATUS_CHUNK = 65536
+def _signal_pid(pid: int, sig: int):
+    if not hasattr(os, 'pidfd_open'):
+        os.kill(pid, 0)
+        os.kill(pid, sig)
+        return
+    pidfd = os.pidfd_open(pid)
+    try:
+        signal.pidfd_send_signal(pidfd, sig)
+    finally:
+        os.close(pidfd)
+def _locked_pid(pid_file: str) -> Optional[int]:
+    try:
+        fd = os.open(pid_file, os.O_RDONLY | os.O_CLOEXEC)
+    except OSError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return None
+    except BlockingIOError:
+        try:
+            return int(os.read(fd, 32).strip())
+        except ValueError:
+            return None
+    finally:
+        os.close(fd)
 class DsmcPlusLentochkaLogs:
-    def __init__(self, config_file: Optional[str] = None):
+    def __init__(self, config_file: Optional[str] = None, config: Optional[configparser.ConfigParser] = None):
         try:
             self.log_manager = logging.getLogger('log_manager')
             self.config_file = config_file or self.find_config_file()
             print(f"Using config file: {self.config_file}")
-            self.config = self.load_config(self.config_file)
+            self.config = config if config is not None else self.load_config(self.config_file)
             self.search_root = self.config.get('Paths', 'search_root')
             self.lentochka_status_dir = self.config.get('Paths', 'lentochka_status_dir', fallback='')
             self.dsmc_log_dir = self.config.get('Logging', 'dsmc_log_dir')
@@ -44,17 +79,21 @@ class DsmcPlusLentochkaLogs:
                 self.log_manager.error("ERROR: 'log_file' parameter is missing in the configuration.")
                 raise ValueError("'log_file' must be specified in the configuration file.")
             self._ensure_log_directories()
-            log_level = self.config.get('Logging', 'log_level', fallback='INFO').upper()
-            log_level = getattr(logging, log_level, logging.INFO)
-            self.log_manager.setLevel(log_level)
+            self.configure_log_manager(self.config)
+            self.log_timestamp = time.strftime(_FILE_TIMESTAMP_FORMAT)
             self._setup_lentochka_logger()
             self._setup_dsmc_logger()
+            self._global_lentochka_fd = os.open(self.lentochka_log_file, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
             self.log_manager.info("DsmcPlusLentochkaLogs initialized successfully")
             self.lentochka_logger.info("Lentochka logging system initialized")
             self.dsmc_logger.info("DSMC logging system initialized")
         except Exception as exception:
             print(f"Error during initialization: {exception}")
             raise
+    def __del__(self):
+        global_fd = getattr(self, '_global_lentochka_fd', None)
+        if global_fd is not None:
+            os.close(global_fd)
     def _ensure_log_directories(self):
         for directory_key, directory in [
             ('lentochka_log_dir', self.lentochka_log_dir),
@@ -73,6 +112,12 @@ class DsmcPlusLentochkaLogs:
             else:
                 print(f"Skipping creation of {directory_key} as it is not specified in config.")
     @staticmethod
+    def configure_log_manager(config: configparser.ConfigParser) -> logging.Logger:
+        log_manager = logging.getLogger('log_manager')
+        log_level = config.get('Logging', 'log_level', fallback='INFO').upper()
+        log_manager.setLevel(getattr(logging, log_level, logging.INFO))
+        return log_manager
+    @staticmethod
     def find_config_file() -> str:
         current_dir = os.path.dirname(os.path.abspath(__file__))
         config_file = os.path.join(current_dir, 'LentochkaDSMC.ini')
@@ -100,6 +145,9 @@ class DsmcPlusLentochkaLogs:
             self.log_manager.error(f"No write access to directory: {directory}")
             return False
         return True
+    @staticmethod
+    def _buffer_handler(handler: logging.Handler) -> logging.handlers.MemoryHandler:
+        return logging.handlers.MemoryHandler(1024, flushLevel=logging.ERROR, target=handler, flushOnClose=True)
     def _setup_lentochka_logger(self):
         log_dir = self.lentochka_log_dir
         if not os.path.exists(log_dir):
@@ -111,16 +159,16 @@ class DsmcPlusLentochkaLogs:
         if rotated_file:
             self.archive_log(rotated_file)
         handler = logging.FileHandler(self.lentochka_log_file)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        self.lentochka_logger.addHandler(handler)
+        handler.setFormatter(_LOG_FORMATTER)
+        self.lentochka_buffer = self._buffer_handler(handler)
+        self.lentochka_logger.addHandler(self.lentochka_buffer)
         self.lentochka_logger.setLevel(logging.DEBUG)
         self.log_manager.info(f"Logging for Lentochka initialized in file: {self.lentochka_log_file}")
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        self.current_iteration_log_file = os.path.join(log_dir, f'lentochka-log-{timestamp}.log')
+        self.current_iteration_log_file = os.path.join(log_dir, f'lentochka-log-{self.log_timestamp}.log')
         self.iteration_handler = logging.FileHandler(self.current_iteration_log_file)
-        self.iteration_handler.setFormatter(formatter)
-        self.lentochka_logger.addHandler(self.iteration_handler)
+        self.iteration_handler.setFormatter(_LOG_FORMATTER)
+        self.iteration_buffer = self._buffer_handler(self.iteration_handler)
+        self.lentochka_logger.addHandler(self.iteration_buffer)
         self.log_manager.info(f"Iteration log for Lentochka created at: {self.current_iteration_log_file}")
     def _setup_dsmc_logger(self):
         log_dir = self.dsmc_log_dir
@@ -133,37 +181,42 @@ class DsmcPlusLentochkaLogs:
         if rotated_file:
             self.archive_log(rotated_file)
         handler = logging.FileHandler(self.dsmc_log_file)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        self.dsmc_logger.addHandler(handler)
+        handler.setFormatter(_LOG_FORMATTER)
+        self.dsmc_buffer = self._buffer_handler(handler)
+        self.dsmc_logger.addHandler(self.dsmc_buffer)
         self.dsmc_logger.setLevel(logging.DEBUG)
         self.log_manager.info(f"Logging for DSMC initialized in file: {self.dsmc_log_file}")
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        self.current_dsmc_session_log_file = os.path.join(log_dir, f'dsmc-session-{timestamp}.log')
+        self.current_dsmc_session_log_file = os.path.join(log_dir, f'dsmc-session-{self.log_timestamp}.log')
         session_handler = logging.FileHandler(self.current_dsmc_session_log_file)
-        session_handler.setFormatter(formatter)
-        self.dsmc_logger.addHandler(session_handler)
+        session_handler.setFormatter(_LOG_FORMATTER)
+        self.dsmc_session_buffer = self._buffer_handler(session_handler)
+        self.dsmc_logger.addHandler(self.dsmc_session_buffer)
         self.dsmc_session_handler = session_handler
         self.log_manager.info(f"Session log for DSMC created at: {self.current_dsmc_session_log_file}")
     def log_lentochka_info(self, message):
         self.lentochka_logger.info(message)
-        self.log_manager.info(f"[Lentochka] {message}")
+        self.log_manager.info("[Lentochka] %s", message)
+    def log_lentochka_debug(self, message):
+        self.lentochka_logger.debug(message)
+        self.log_manager.debug("[Lentochka] %s", message)
+    def flush_lentochka_log(self):
+        self.lentochka_buffer.flush()
+        self.iteration_buffer.flush()
     def log_lentochka_error(self, message):
         self.lentochka_logger.error(message)
-        self.log_manager.error(f"[Lentochka] {message}")
+        self.log_manager.error("[Lentochka] %s", message)
     def log_dsmc_info(self, message):
         self.dsmc_logger.info(message)
-        self.log_manager.info(f"[DSMC] {message}")
+        self.log_manager.info("[DSMC] %s", message)
     def log_dsmc_error(self, message):
         self.dsmc_logger.error(message)
-        self.log_manager.error(f"[DSMC] {message}")
+        self.log_manager.error("[DSMC] %s", message)
     def append_dsmc_log_to_global(self, log_file_path):
         try:
             with open(log_file_path, 'r') as log_file:
-                log_content = log_file.read()
                 self.log_dsmc_info(f"--- Begin DSMC log {os.path.basename(log_file_path)} ---")
-                for line in log_content.splitlines():
-                    self.dsmc_logger.info(line)
+                for line in log_file:
+                    self.dsmc_logger.info(line.rstrip('\r\n'))
                 self.log_dsmc_info(f"--- End DSMC log {os.path.basename(log_file_path)} ---")
                 self.log_manager.info(f"DSMC log appended to global log: {log_file_path}")
                 return True
@@ -172,7 +225,10 @@ class DsmcPlusLentochkaLogs:
             return False
     def rotate_log(self, log_file: str) -> Optional[str]:
         max_size = 1_073_741_824  
-        if not os.path.exists(log_file) or os.path.getsize(log_file) < max_size:
+        try:
+            if os.stat(log_file).st_size < max_size:
+                return None
+        except FileNotFoundError:
             return None
         log_dir = os.path.dirname(log_file)
         log_base = os.path.basename(log_file)  
@@ -183,14 +239,13 @@ class DsmcPlusLentochkaLogs:
                 break
             n += 1
         try:
-            for handler in self.lentochka_logger.handlers:
-                if isinstance(handler, logging.FileHandler) and handler.baseFilename == os.path.abspath(log_file):
-                    handler.close()
-                    self.lentochka_logger.removeHandler(handler)
-            for handler in self.dsmc_logger.handlers:
-                if isinstance(handler, logging.FileHandler) and handler.baseFilename == os.path.abspath(log_file):
-                    handler.close()
-                    self.dsmc_logger.removeHandler(handler)
+            for logger in (self.lentochka_logger, self.dsmc_logger):
+                for handler in list(logger.handlers):
+                    target = getattr(handler, 'target', handler)
+                    if isinstance(target, logging.FileHandler) and target.baseFilename == os.path.abspath(log_file):
+                        handler.close()
+                        target.close()
+                        logger.removeHandler(handler)
             os.rename(log_file, rotated_file)
             self.log_manager.info(f"Rotated log file: {log_file} -> {rotated_file}")
             if "lentochka" in log_base:
@@ -202,11 +257,15 @@ class DsmcPlusLentochkaLogs:
             self.log_manager.error(f"Error rotating log file {log_file}: {e}")
             return None
     def archive_log(self, rotated_file: str) -> bool:
-        if not rotated_file or not os.path.exists(rotated_file):
+        if not rotated_file:
+            return False
+        try:
+            f_in = open(rotated_file, 'rb')
+        except FileNotFoundError:
             return False
         try:
             gz_file = f"{rotated_file}.gz"
-            with open(rotated_file, 'rb') as f_in:
+            with f_in:
                 with gzip.open(gz_file, 'wb') as f_out:
                     while True:
                         chunk = f_in.read(8192)  
@@ -222,21 +281,23 @@ class DsmcPlusLentochkaLogs:
     def close_iteration_log(self):
         if hasattr(self, 'iteration_handler') and self.iteration_handler:
             try:
+                self.lentochka_buffer.flush()
+                self.iteration_buffer.close()
+                self.lentochka_logger.removeHandler(self.iteration_buffer)
                 self.iteration_handler.close()
-                self.lentochka_logger.removeHandler(self.iteration_handler)
-                if os.path.exists(self.current_iteration_log_file) and os.path.getsize(
-                        self.current_iteration_log_file) > 0:
-                    with open(self.current_iteration_log_file, 'r') as temp_log:
+                try:
+                    with open(self.current_iteration_log_file, 'rb') as temp_log:
                         log_content = temp_log.read()
-                        with open(self.lentochka_log_file, 'r') as check_log:
-                            existing_content = check_log.read()
-                            if log_content not in existing_content:
-                                with open(self.lentochka_log_file, 'a') as global_log:
-                                    global_log.write(
-                                        f"\n--- Begin Iteration Log {os.path.basename(self.current_iteration_log_file)} ---\n")
-                                    global_log.write(log_content)
-                                    global_log.write(
-                                        f"\n--- End Iteration Log {os.path.basename(self.current_iteration_log_file)} ---\n")
+                except FileNotFoundError:
+                    log_content = b''
+                if log_content:
+                    global_fd = self._global_lentochka_fd
+                    existing_content = os.pread(global_fd, os.fstat(global_fd).st_size, 0)
+                    if log_content not in existing_content:
+                        iteration_name = os.path.basename(self.current_iteration_log_file)
+                        os.writev(global_fd, [f"\n--- Begin Iteration Log {iteration_name} ---\n".encode(),
+                                              log_content,
+                                              f"\n--- End Iteration Log {iteration_name} ---\n".encode()])
                 self.log_manager.info(
                     f"Iteration log closed and appended to global log: {self.current_iteration_log_file}")
             except Exception as e:
@@ -257,42 +318,72 @@ class DsmcPlusLentochkaLogs:
         if not self.lentochka_status_dir:
             return
         try:
-            if not os.path.exists(self.lentochka_status_dir):
-                return  
-            for log_file in os.listdir(self.lentochka_status_dir):
-                if log_file.endswith('.log'):
-                    log_path = os.path.join(self.lentochka_status_dir, log_file)
-                    if os.path.getsize(log_path) == 0:
-                        os.remove(log_path)
-                        self.log_manager.info(f'Deleted empty log file: {log_path}')
+            try:
+                entries = os.scandir(self.lentochka_status_dir)
+            except FileNotFoundError:
+                return
+            with entries:
+                for entry in entries:
+                    if not entry.name.endswith('.log') or not entry.is_file(follow_symlinks=False):
+                        continue
+                    try:
+                        size = entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+                    if size == 0:
+                        try:
+                            os.remove(entry.path)
+                            self.log_manager.info('Deleted empty log file: %s', entry.path)
+                        except OSError as file_error:
+                            self.log_manager.error(f"Error removing file {entry.path}: {file_error}")
         except Exception as e:
             self.log_manager.error(f"Error during log cleanup: {e}")
 class MonitoringHandler:
+    _SANITIZE_TABLE = str.maketrans({' ': '_', '/': '_', '\\': '_'})
     def __init__(self, config, log_manager):
         self.config = config
         self.log_manager = log_manager
         self.enabled = config.getboolean('Monitoring', 'enabled', fallback=False)
         self.script = config.get('Monitoring', 'monitoring_script', fallback=None)
+        self.script_path = (shutil.which(self.script) or self.script) if self.script else None
         self.interval = config.getint('Monitoring', 'interval', fallback=300)
-        self.log_dir = config.get('Paths', 'log_dir', fallback='logs')
+        self.batch = config.getboolean('Monitoring', 'batch', fallback=False)
+        self._metric_buffer = []
+        if self.batch:
+            atexit.register(self.flush_metrics)
+        self.log_dir = config.get('Paths', 'log_dir', fallback=None)
         self.log_retention_days = config.getint('Logging', 'log_retention_days', fallback=90)
         self.log_cleanup_enabled = config.getboolean('Logging', 'log_cleanup_enabled', fallback=True)
         search_root = config.get('Paths', 'search_root')
         self.log_manager.info(f"Search directory specified in .ini file: {search_root}")
     @staticmethod
     def sanitize_metric_name(name):
-        return name.replace(' ', '_').replace('/', '_').replace('\\', '_')
+        return name.translate(MonitoringHandler._SANITIZE_TABLE)
     def send_metric(self, metric_name, value, status='OK'):
         if not self.enabled or not self.script:
             self.log_manager.warning("Monitoring is disabled or monitoring script is not set.")
             return
         try:
             sanitized_name = self.sanitize_metric_name(metric_name)
-            cmd = [self.script, sanitized_name, str(value), status]
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
+            if self.batch:
+                self._metric_buffer.append(f"{sanitized_name}\t{value}\t{status}\n")
+                self.log_manager.info(f"Metric queued: {sanitized_name} with value: {value} and status: {status}")
+                return
+            cmd = [self.script_path, sanitized_name, str(value), status]
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             self.log_manager.info(f"Metric sent: {sanitized_name} with value: {value} and status: {status}")
         except subprocess.CalledProcessError as error:
             self.log_manager.error(f"Error sending metric to monitoring: {error}")
+    def flush_metrics(self):
+        if not self._metric_buffer:
+            return
+        metrics, self._metric_buffer = self._metric_buffer, []
+        try:
+            subprocess.run([self.script_path, '--batch'], input=''.join(metrics).encode(), check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.log_manager.info(f"Metrics batch sent: {len(metrics)} metrics")
+        except (OSError, subprocess.CalledProcessError) as error:
+            self.log_manager.error(f"Error sending metrics batch to monitoring: {error}")
     def cleanup_logs(self, log_dir, log_retention_days):
         if not self.log_cleanup_enabled:
             self.log_manager.info("Automatic log cleanup is disabled.")
@@ -311,17 +402,21 @@ class MonitoringHandler:
                 self.log_manager.warning(f"Cannot create log directory {log_dir}: {e}")
                 return 0
         deleted_files_count = 0
-        for log_file in os.listdir(log_dir):
-            log_file_path = os.path.join(log_dir, log_file)
-            if os.path.isfile(log_file_path):
-                file_age_days = (datetime.datetime.now() - datetime.datetime.fromtimestamp(
-                    os.path.getmtime(log_file_path))).days
-                if file_age_days > log_retention_days:
+        cutoff_ts = time.time() - (log_retention_days + 1) * 86400
+        with os.scandir(log_dir) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                try:
+                    mtime = entry.stat(follow_symlinks=False).st_mtime
+                except OSError:
+                    continue
+                if mtime <= cutoff_ts:
                     try:
-                        os.remove(log_file_path)
+                        os.remove(entry.path)
                         deleted_files_count += 1
-                    except Exception as file_error:
-                        self.log_manager.error(f"Error removing file {log_file_path}: {file_error}")
+                    except OSError as file_error:
+                        self.log_manager.error(f"Error removing file {entry.path}: {file_error}")
         if deleted_files_count > 0:
             self.log_manager.info(f"Deleted {deleted_files_count} old logs.")
         return deleted_files_count
@@ -335,93 +430,40 @@ class MonitoringHandler:
 class ProcessLocker:
     def __init__(self, lock_file_path, log_manager, max_instances):
         self.lock_file_path = lock_file_path
-        self.pid_file = None
+        self.lock_fd = None
         self.log_manager = log_manager
         self.max_instances = max_instances
-    def _find_existing_process(self):
+    def _lock_slot_paths(self) -> List[str]:
+        return [self.lock_file_path] + [f"{self.lock_file_path}.{n}" for n in range(1, self.max_instances)]
+    @staticmethod
+    def _try_lock(lock_path: str) -> Optional[int]:
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR | os.O_CLOEXEC, 0o600)
         try:
-            if not os.path.exists(self.lock_file_path):
-                return None
-            with open(self.lock_file_path, 'r') as f:
-                pid = int(f.read().strip())
-            try:
-                os.kill(pid, 0)
-                return pid
-            except OSError:
-                return None
-        except (IOError, ValueError) as read_error:
-            self.log_manager.error(f"Error reading PID from file {self.lock_file_path}: {read_error}")
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
             return None
-    def is_process_running(self):
-        current_pid = os.getpid()
-        running_processes = 0
-        for proc in psutil.process_iter(['pid', 'name']):
-            if proc.info['pid'] != current_pid and proc.info['name'] == 'python3':
-                cmdline = proc.cmdline()
-                if len(cmdline) > 0 and 'LentochkaDSMC.py' in cmdline:
-                    running_processes += 1
-        if running_processes >= self.max_instances:
-            self.log_manager.warning(f"Max instances reached ({self.max_instances}). Process cannot be started.")
-            return True
-        return False
-    def terminate_existing_process(self):
-        pid = self._find_existing_process()
-        if pid is not None:
-            self.log_manager.warning(f"Found active process with PID {pid}. Terminating.")
-            try:
-                os.kill(pid, signal.SIGTERM)
-                time.sleep(3)
-                try:
-                    os.kill(pid, signal.SIGKILL)
-                    self.log_manager.warning(f"Process {pid} did not terminate, forcing termination.")
-                except ProcessLookupError:
-                    self.log_manager.info(f"Process {pid} already terminated.")
-                if os.path.exists(self.lock_file_path):
-                    os.unlink(self.lock_file_path)
-            except Exception as terminate_error:
-                self.log_manager.error(f"Error terminating process {pid}: {terminate_error}")
-        else:
-            self.log_manager.info("No active processes to terminate.")
-    def is_stale_lock(self):
-        if os.path.exists(self.lock_file_path):
-            try:
-                with open(self.lock_file_path, 'r') as f:
-                    pid = int(f.read().strip())
-                try:
-                    os.kill(pid, 0)
-                    return False
-                except OSError:
-                    return True
-            except (IOError, ValueError):
-                return True
-        return False
+        return fd
     def __enter__(self):
-        if self.is_stale_lock():
-            self.log_manager.warning("Stale lock file found, removing it.")
-            try:
-                os.remove(self.lock_file_path)
-            except Exception as remove_error:
-                self.log_manager.error(f"Error removing stale lock file: {remove_error}")
-        if self.is_process_running():
-            raise RuntimeError("Another instance of the process is already running.")
-        self.terminate_existing_process()
-        lock_file = self.lock_file_path
-        lock_dir = os.path.dirname(lock_file)
+        lock_dir = os.path.dirname(self.lock_file_path)
         if lock_dir and not os.path.exists(lock_dir):
             os.makedirs(lock_dir)
-        if os.path.exists(lock_file):
-            os.remove(lock_file)
-        self.pid_file = open(lock_file, 'w')
-        self.pid_file.write(str(os.getpid()))
-        self.pid_file.flush()
+        for lock_path in self._lock_slot_paths():
+            self.lock_fd = self._try_lock(lock_path)
+            if self.lock_fd is not None:
+                break
+        else:
+            self.log_manager.warning(f"Max instances reached ({self.max_instances}). Process cannot be started.")
+            raise RuntimeError("Another instance of the process is already running.")
+        os.ftruncate(self.lock_fd, 0)
+        os.write(self.lock_fd, str(os.getpid()).encode())
         self.log_manager.info(f"Process lock acquired with PID {os.getpid()}")
         return self
     def __exit__(self, exc_type, exc_val, exc_tb):
         try:
-            if self.pid_file:
-                self.pid_file.close()
-            if os.path.exists(self.lock_file_path):
-                os.unlink(self.lock_file_path)
+            if self.lock_fd is not None:
+                os.close(self.lock_fd)
+                self.lock_fd = None
             self.log_manager.info("Process lock released.")
         except Exception as release_error:
             self.log_manager.error(f"Error releasing resources: {release_error}")
@@ -432,94 +474,156 @@ class StanzaProcessor:
         self.log_manager = lentochka_log.log_manager
         self.lentochka_log.validate_dsmc_log_dir()
         self.lentochka_log.validate_lentochka_log_dir()
-    def find_stanzas(self) -> List[Dict[str, Any]]:
-        stanzas = []
-        search_root = Path(self.config.get('Paths', 'search_root'))
+        self._dsmc_log_prefix = os.path.join(lentochka_log.dsmc_log_dir, '')
+        self.dsmc_path = config.get('DSMC', 'dsmc_path', fallback='dsmc')
+        self.dsmc_full_path = shutil.which(self.dsmc_path)
+        self.dsmc_command_template = config.get('DSMC', 'dsmc_command_template',
+                                                fallback='{dsmc_path} incr {backup_dirs} -su=yes')
+        self._dsmc_argv_template = shlex.split(self.dsmc_command_template)
+        self.use_shell = config.getboolean('DSMC', 'use_shell', fallback=False)
+        self.search_root = os.path.abspath(config.get('Paths', 'search_root'))
+        self.excluded_dirs = frozenset(os.path.abspath(path.strip())
+                                       for path in config.get('Paths', 'excluded_dirs', fallback='').split(',')
+                                       if path.strip())
+        self.status_read_workers = config.getint('Process', 'status_read_workers', fallback=32)
+        self.skip_processed_status = config.getboolean('Process', 'skip_processed_status', fallback=False)
+        self.stanza_workers = config.getint('Process', 'stanza_workers',
+                                            fallback=config.getint('Process', 'max_instances', fallback=1))
+    def iter_stanzas(self) -> Iterator[Dict[str, Any]]:
         rsync_status_count = {'total': 0, 'completed': 0, 'failed': 0, 'missing': 0}
         lentochka_status_count = {'total': 0}
-        repo_status = {}
-        for repo_dir in search_root.glob('*.repo'):
-            repo_path = str(repo_dir)
-            backup_dir = repo_dir / 'backup'
-            if not backup_dir.exists():
-                self.lentochka_log.log_lentochka_error(f"Backup directory not found: {backup_dir}")
-                continue
-            has_failed = False
-            for rsync_status_path in backup_dir.rglob('rsync.status'):
-                rsync_status_count['total'] += 1
-                rsync_dir = rsync_status_path.parent
-                lentochka_status_path = rsync_dir / 'lentochka-status'
-                if lentochka_status_path.exists():
-                    lentochka_status_count['total'] += 1
-                try:
-                    with open(rsync_status_path, 'r') as f:
-                        status_content = f.read().strip().lower()
-                        if 'failed' in status_content:
-                            rsync_status_count['failed'] += 1
-                            has_failed = True
-                        elif 'complete' in status_content:
-                            rsync_status_count['completed'] += 1
-                        else:
-                            rsync_status_count['missing'] += 1
-                except IOError as exception:
-                    self.lentochka_log.log_lentochka_error(f"Error reading file {rsync_status_path}: {exception}")
-                    rsync_status_count['missing'] += 1
-            repo_status[repo_path] = has_failed
+        repo_status_paths = []
+        log_debug = self.log_manager.isEnabledFor(logging.DEBUG)
+        with ThreadPoolExecutor(max_workers=self.status_read_workers) as pool:
+            repo_paths = self._scan_repos(self.search_root, self.excluded_dirs)
+            for repo_path, paths in zip(repo_paths, pool.map(self._walk_backup_dir, repo_paths)):
+                if paths is None:
+                    self.lentochka_log.log_lentochka_error(f"Backup directory not found: {repo_path}/backup")
+                    continue
+                repo_status_paths.append((repo_path, paths))
+            rsync_statuses = {path: pool.submit(self._read_rsync_status, path)
+                              for _, paths in repo_status_paths for _, path, lentochka_done in paths
+                              if not (lentochka_done and self.skip_processed_status)}
+            for repo_path, paths in repo_status_paths:
+                has_failed = False
+                for _, rsync_status_path, lentochka_done in paths:
+                    rsync_status_count['total'] += 1
+                    if lentochka_done:
+                        lentochka_status_count['total'] += 1
+                        if self.skip_processed_status:
+                            continue
+                    status, exception = rsync_statuses[rsync_status_path].result()
+                    if exception is not None:
+                        self.lentochka_log.log_lentochka_error(f"Error reading file {rsync_status_path}: {exception}")
+                    rsync_status_count[status] += 1
+                    if status == 'failed':
+                        has_failed = True
+                if has_failed:
+                    self.lentochka_log.log_lentochka_info(
+                        f"Skipping entire repo {repo_path} due to at least one failed rsync.status")
+                    continue
+                for rsync_dir, rsync_status_path, lentochka_done in paths:
+                    lentochka_status_path = f"{rsync_dir}/lentochka-status"
+                    if lentochka_done:
+                        if log_debug:
+                            self.lentochka_log.log_lentochka_debug(
+                                f"Stanza already processed: {repo_path} (at {lentochka_status_path})")
+                        continue
+                    if rsync_statuses[rsync_status_path].result()[0] == 'completed':
+                        try:
+                            with os.scandir(rsync_dir) as entries:
+                                subdirs = [entry.name for entry in entries if entry.is_dir()]
+                        except OSError as exception:
+                            self.lentochka_log.log_lentochka_error(f"Error reading file {rsync_dir}: {exception}")
+                            continue
+                        stanza = {
+                            'status_path': rsync_status_path,
+                            'repo_path': repo_path,
+                            'backup_path': rsync_dir,
+                            'status': 'completed',
+                            'lentochka_status_path': lentochka_status_path,
+                            'subdirs': subdirs,
+                            'backup_name_safe': rsync_dir.translate(_PATH_NAME_TABLE).lstrip('-')
+                        }
+                        self.lentochka_log.log_lentochka_info(
+                            f"Stanza added to processing queue: {repo_path} (at {rsync_status_path})")
+                        yield stanza
         self.lentochka_log.log_lentochka_info(
             f"RESULTS: Found {rsync_status_count['total']} rsync.status files, "
             f"successfully copied: {rsync_status_count['completed']}, failed: {rsync_status_count['failed']}, "
             f"missing: {rsync_status_count['missing']}, "
             f"lentochka-status found: {lentochka_status_count['total']}"
         )
-        for repo_dir in search_root.glob('*.repo'):
-            repo_path = str(repo_dir)
-            backup_dir = repo_dir / 'backup'
-            if not backup_dir.exists():
-                continue
-            if repo_status.get(repo_path, False):
-                self.lentochka_log.log_lentochka_info(
-                    f"Skipping entire repo {repo_path} due to at least one failed rsync.status")
+    def _walk_backup_dir(self, repo_path: str) -> Optional[List[Tuple[str, str, bool]]]:
+        backup_dir = f"{repo_path}/backup"
+        if not os.path.exists(backup_dir):
+            return None
+        return list(self._walk_rsync_status(backup_dir, self.excluded_dirs))
+    @staticmethod
+    def _scan_repos(search_root: str, excluded_dirs: frozenset = frozenset()) -> List[str]:
+        try:
+            with os.scandir(search_root) as entries:
+                return [entry.path for entry in entries
+                        if entry.name.endswith('.repo') and entry.path not in excluded_dirs]
+        except OSError:
+            return []
+    @staticmethod
+    def _walk_rsync_status(backup_dir: str, excluded_dirs: frozenset = frozenset()):
+        stack = [backup_dir]
+        while stack:
+            directory = stack.pop()
+            rsync_status_path = None
+            lentochka_done = False
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.path not in excluded_dirs:
+                                stack.append(entry.path)
+                        elif entry.name == 'rsync.status' and entry.is_file():
+                            rsync_status_path = entry.path
+                        elif entry.name == 'lentochka-status':
+                            lentochka_done = True
+            except OSError:
                 continue
-            for rsync_status_path in backup_dir.rglob('rsync.status'):
-                rsync_dir = rsync_status_path.parent
-                lentochka_status_path = rsync_dir / 'lentochka-status'
-                if lentochka_status_path.exists():
-                    self.lentochka_log.log_lentochka_info(
-                        f"Stanza already processed: {repo_path} (at {lentochka_status_path})")
-                    continue
-                try:
-                    with open(rsync_status_path, 'r') as f:
-                        status_content = f.read().strip().lower()
-                        if 'failed' in status_content:
-                            continue
-                        if 'complete' in status_content:
-                            stanza = {
-                                'status_path': str(rsync_status_path),
-                                'repo_path': repo_path,
-                                'backup_path': str(rsync_dir),
-                                'status': 'completed',
-                                'lentochka_status_path': str(lentochka_status_path),
-                                'subdirs': [d.name for d in rsync_dir.iterdir() if d.is_dir()]
-                            }
-                            stanzas.append(stanza)
-                            self.lentochka_log.log_lentochka_info(
-                                f"Stanza added to processing queue: {repo_path} (at {rsync_status_path})")
-                except IOError as exception:
-                    self.lentochka_log.log_lentochka_error(f"Error reading file {rsync_status_path}: {exception}")
-        return stanzas
+            if rsync_status_path is not None:
+                yield directory, rsync_status_path, lentochka_done
+    @staticmethod
+    def _read_rsync_status(rsync_status_path) -> Tuple[str, Optional[Exception]]:
+        completed = False
+        tail = b''
+        try:
+            fd = os.open(rsync_status_path, os.O_RDONLY | os.O_CLOEXEC)
+        except OSError as exception:
+            return 'missing', exception
+        try:
+            while True:
+                chunk = os.read(fd, _RSYNC_STATUS_CHUNK)
+                if not chunk:
+                    break
+                status_content = tail + chunk
+                for match in _RSYNC_STATUS_RE.finditer(status_content):
+                    if match.group().lower() == b'failed':
+                        return 'failed', None
+                    completed = True
+                tail = status_content[-7:]
+        except OSError as exception:
+            return 'missing', exception
+        finally:
+            os.close(fd)
+        return ('completed' if completed else 'missing'), None
     def process_stanza(self, stanza_info: Dict[str, Any]) -> bool:
         try:
-            self.lentochka_log.validate_dsmc_log_dir()
             start_time = datetime.datetime.now()
             self.lentochka_log.log_lentochka_info(
                 f"Starting to process stanza: {stanza_info['repo_path']} at {start_time} (backup: {stanza_info['backup_path']})")
-            backup_path = Path(stanza_info['backup_path'])
-            lentochka_status_path = Path(stanza_info['lentochka_status_path'])  
-            if lentochka_status_path.exists():
+            backup_path = stanza_info['backup_path']
+            lentochka_status_path = stanza_info['lentochka_status_path']
+            if os.path.exists(lentochka_status_path):
                 self.lentochka_log.log_lentochka_info(
                     f"Stanza ({stanza_info['repo_path']}) already processed, skipping (at {lentochka_status_path}).")
                 return True
-            if not backup_path.exists():
+            if not os.path.exists(backup_path):
                 self.lentochka_log.log_lentochka_error(
                     f"Skipping stanza: Path does not exist: {backup_path}")
                 return False
@@ -527,23 +631,22 @@ class StanzaProcessor:
                 self.lentochka_log.log_lentochka_info(
                     f"Skipping stanza with failed status: {stanza_info['repo_path']}")
                 return False
-            dsmc_path = self.config.get('DSMC', 'dsmc_path', fallback='dsmc')
-            dsmc_command_template = self.config.get('DSMC', 'dsmc_command_template',
-                                                    fallback='{dsmc_path} incr {backup_dirs} -su=yes')
-            command = dsmc_command_template.format(
-                dsmc_path=dsmc_path,
-                backup_dirs=str(backup_path)  
+            command = self.dsmc_command_template.format(
+                dsmc_path=self.dsmc_path,
+                backup_dirs=backup_path
             )
+            dsmc_exec_path = self.dsmc_full_path or self.dsmc_path
+            dsmc_argv = [arg.format(dsmc_path=dsmc_exec_path, backup_dirs=backup_path)
+                         for arg in self._dsmc_argv_template]
             return_code = self.run_dsmc_command(
-                {**stanza_info, 'dsmc_command': command},
+                {**stanza_info, 'dsmc_command': command, 'dsmc_argv': dsmc_argv},
                 start_time
             )
             if return_code == 0:
                 end_time = datetime.datetime.now()
                 status_content = f"Backup written to tape\nStart: {start_time.isoformat()}\nEnd: {end_time.isoformat()}"
                 try:
-                    with open(lentochka_status_path, 'w') as f:
-                        f.write(status_content)
+                    self.write_status_file(lentochka_status_path, status_content)
                     self.lentochka_log.log_lentochka_info(
                         f"Finished processing stanza {stanza_info['repo_path']} - status: completed, file lentochka-status created at {lentochka_status_path}")
                     return True
@@ -558,110 +661,124 @@ class StanzaProcessor:
         except Exception as exception:
             self.lentochka_log.log_lentochka_error(f"Uncaught error processing stanza: {exception}")
             return False
+    @staticmethod
+    def write_status_file(status_path: str, status_content: str):
+        tmp_path = f"{status_path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, status_content.encode())
+            os.fsync(fd)
+        except Exception:
+            os.close(fd)
+            os.unlink(tmp_path)
+            raise
+        os.close(fd)
+        os.rename(tmp_path, status_path)
     def run_dsmc_command(self, stanza_info: Dict[str, Any], start_time: datetime.datetime) -> int:
         log_file_path = None
+        error_reported = False
+        repo_path = stanza_info['repo_path']
+        log_info = self.lentochka_log.log_lentochka_info
+        log_error = self.lentochka_log.log_lentochka_error
         try:
-            dsmc_log_dir = self.config.get('Logging', 'dsmc_log_dir', fallback='logs/dsmc')
-            if not os.path.exists(dsmc_log_dir):
-                os.makedirs(dsmc_log_dir)
-                self.lentochka_log.log_lentochka_info(f"Created DSMC log directory: {dsmc_log_dir}, yo")
-            stanza_path = stanza_info['repo_path']
-            stanza_name = stanza_path.replace('/', '-').replace('\\', '-').lstrip('-')
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            log_filename = f"dsmc-log-{stanza_name}-{timestamp}.log"
-            log_file_path = os.path.join(dsmc_log_dir, log_filename)
-            pid_filename = f"dsmc_{stanza_name}-{timestamp}.pid"
-            pid_file_path = os.path.join('/tmp', pid_filename)  
-            self.lentochka_log.log_lentochka_info(
-                f"Starting DSMC command at {start_time} for stanza: {stanza_info['repo_path']}")
-            self.lentochka_log.log_lentochka_info(f"DSMC log will be written to: {log_file_path}")
+            timestamp = start_time.strftime(_FILE_TIMESTAMP_FORMAT)
+            log_file_path = f"{self._dsmc_log_prefix}dsmc-log-{stanza_info['backup_name_safe']}-{timestamp}.log"
+            pid_filename = f"dsmc_{stanza_info['backup_name_safe']}-{timestamp}.pid"
+            pid_file_path = f"{_PID_DIR}{pid_filename}"
+            log_info(f"Starting DSMC command at {start_time} for stanza: {repo_path}")
             command = stanza_info['dsmc_command']
-            self.lentochka_log.log_lentochka_info(f"Executing command: {command}")
-            with open(log_file_path, 'w') as log_file:
-                process = subprocess.Popen(
-                    command,
-                    shell=True,
-                    stdout=log_file,
-                    stderr=subprocess.STDOUT
-                )
-                with open(pid_file_path, 'w') as pid_file:
-                    pid_file.write(str(process.pid))
-                self.lentochka_log.log_lentochka_info(
-                    f"DSMC started with PID {process.pid}, PID saved to {pid_filename}, yo")  
+            if self.log_manager.isEnabledFor(logging.DEBUG):
+                self.lentochka_log.log_lentochka_debug(f"DSMC log will be written to: {log_file_path}")
+                self.lentochka_log.log_lentochka_debug(f"Executing command: {command}")
+            use_shell = self.use_shell
+            pid_tmp_path = f"{pid_file_path}.tmp"
+            pid_fd = os.open(pid_tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o600)
+            try:
+                fcntl.flock(pid_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                log_fd = os.open(log_file_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_CLOEXEC, 0o640)
+                try:
+                    process = subprocess.Popen(
+                        command if use_shell else stanza_info['dsmc_argv'],
+                        shell=use_shell,
+                        stdout=log_fd,
+                        stderr=subprocess.STDOUT,
+                        pass_fds=(pid_fd,)
+                    )
+                except Exception as popen_error:
+                    os.write(log_fd, self._dsmc_error_report(popen_error, repo_path).encode())
+                    error_reported = True
+                    raise
+                finally:
+                    os.close(log_fd)
+                os.write(pid_fd, str(process.pid).encode())
+                os.replace(pid_tmp_path, pid_file_path)
+            except Exception:
+                with suppress(OSError):
+                    os.remove(pid_tmp_path)
+                raise
+            finally:
+                os.close(pid_fd)
+            log_info(f"DSMC started with PID {process.pid}, PID saved to {pid_filename}, yo")
+            self.lentochka_log.flush_lentochka_log()
             return 0
         except Exception as e:
-            error_msg = f"Error starting DSMC command: {e}, shit happens"
-            self.lentochka_log.log_lentochka_error(error_msg)
+            log_error(f"Error starting DSMC command: {e}, shit happens")
             if log_file_path:
-                with open(log_file_path, 'w') as error_log:
-                    error_log.write(f"CRITICAL ERROR: {error_msg}\n")
-                    error_log.write(f"Exception occurred at: {datetime.datetime.now().isoformat()}\n")
-                    error_log.write(f"Stanza path: {stanza_info['repo_path']}\n")
+                if not error_reported:
+                    with open(log_file_path, 'a') as error_log:
+                        error_log.write(self._dsmc_error_report(e, repo_path))
                 self.lentochka_log.append_dsmc_log_to_global(log_file_path)
             return 1
-    def _check_dsmc_exists(self, dsmc_path: str) -> bool:
+    @staticmethod
+    def _dsmc_error_report(error: Exception, repo_path: str) -> str:
+        return (f"CRITICAL ERROR: Error starting DSMC command: {error}, shit happens\n"
+                f"Exception occurred at: {datetime.datetime.now().isoformat()}\n"
+                f"Stanza path: {repo_path}\n")
+def reap_stale_dsmc_pids(log_manager: logging.Logger):
+    with os.scandir(_PID_DIR) as entries:
+        pid_files = [entry.path for entry in entries
+                     if entry.name.startswith('dsmc_') and entry.name.endswith(('.pid', '.pid.tmp'))
+                     and entry.is_file(follow_symlinks=False)]
+    old_pids = []
+    for pid_file in pid_files:
+        pid = _locked_pid(pid_file)
+        if pid is not None:
+            old_pids.append(pid)
+    killed_pids = []
+    for pid in old_pids:
         try:
-            self.lentochka_log.log_lentochka_info(f"Checking existence of DSMC at path: {dsmc_path}")
-            if os.path.isabs(dsmc_path):
-                exists = os.path.exists(dsmc_path) and os.access(dsmc_path, os.X_OK)
-                if exists:
-                    self.lentochka_log.log_lentochka_info(f"Found DSMC executable at: {dsmc_path}")
-                else:
-                    self.lentochka_log.log_lentochka_error(f"DSMC executable not found at path: {dsmc_path}")
-                return exists
-            else:
-                which_cmd = 'where' if sys.platform == 'win32' else 'which'
-                try:
-                    result = subprocess.run([which_cmd, dsmc_path],
-                                            capture_output=True,
-                                            text=True)
-                    if result.returncode == 0:
-                        dsmc_full_path = result.stdout.strip()
-                        self.lentochka_log.log_lentochka_info(f"Found DSMC in PATH at: {dsmc_full_path}")
-                        return True
-                    else:
-                        self.lentochka_log.log_lentochka_error(f"DSMC utility not found in PATH")
-                        return False
-                except Exception as which_error:
-                    self.lentochka_log.log_lentochka_error(f"Error checking DSMC with '{which_cmd}': {which_error}")
-                    return False
-        except Exception as e:
-            self.lentochka_log.log_lentochka_error(f"Error checking DSMC existence: {e}")
-            return False
+            _signal_pid(pid, signal.SIGTERM)
+            killed_pids.append(pid)
+        except OSError:
+            pass
+    for pid_file in pid_files:
+        with suppress(OSError):
+            os.remove(pid_file)
+    if killed_pids:
+        log_manager.info(f"Found {len(killed_pids)} old DSMC processes with PIDs {killed_pids}, killed them, suka!")
+    if len(pid_files) > len(killed_pids):
+        log_manager.info(f"Removed {len(pid_files) - len(killed_pids)} stale or invalid old PID files, yo")
 def main():
     global monitoring
-    dsmc_log = None  
     monitoring = None
+    log_manager = logging.getLogger('log_manager')
     try:
-        dsmc_log = DsmcPlusLentochkaLogs()
-        monitoring = MonitoringHandler(dsmc_log.config, dsmc_log.log_manager)
-        max_instances = dsmc_log.config.getint('Process', 'max_instances', fallback=1)
-        lock_file = dsmc_log.config.get('Paths', 'lock_file', fallback='/tmp/lentochka_dsmc.lock')
-        process_locker = ProcessLocker(lock_file, dsmc_log.log_manager, max_instances)
-        pid_dir = '/tmp'
-        for pid_file in glob.glob(os.path.join(pid_dir, 'dsmc_*.pid')):
-            try:
-                with open(pid_file, 'r') as f:
-                    pid = int(f.read().strip())
-                os.kill(pid, 0)  
-                os.kill(pid, signal.SIGTERM)  
-                dsmc_log.log_manager.info(f"Found old DSMC process with PID {pid}, killed it, suka!")
-                os.remove(pid_file)
-            except (OSError, ValueError, IOError):
-                dsmc_log.log_manager.info(f"Old PID file {pid_file} stale or invalid, removed, yo")
-                try:
-                    os.remove(pid_file)
-                except OSError:
-                    pass
+        config_file = DsmcPlusLentochkaLogs.find_config_file()
+        config = DsmcPlusLentochkaLogs.load_config(config_file)
+        DsmcPlusLentochkaLogs.configure_log_manager(config)
+        monitoring = MonitoringHandler(config, log_manager)
+        max_instances = config.getint('Process', 'max_instances', fallback=1)
+        lock_file = config.get('Paths', 'lock_file', fallback='/tmp/lentochka_dsmc.lock')
+        process_locker = ProcessLocker(lock_file, log_manager, max_instances)
         with process_locker:
-            if monitoring.script and not os.path.exists(monitoring.script):
+            reap_stale_dsmc_pids(log_manager)
+            dsmc_log = DsmcPlusLentochkaLogs(config_file, config)
+            if monitoring.script and not os.path.exists(monitoring.script_path):
                 dsmc_log.log_manager.error(f"Monitoring script not found at path: {monitoring.script}")
                 monitoring.enabled = False
             dsmc_log.log_manager.info("Starting main script execution, hell yeah!")
             stanza_processor = StanzaProcessor(dsmc_log.config, dsmc_log)
-            stanzas = stanza_processor.find_stanzas()
-            dsmc_path = dsmc_log.config.get('DSMC', 'dsmc_path', fallback='dsmc')
-            dsmc_exists = shutil.which(dsmc_path) is not None
+            dsmc_exists = stanza_processor.dsmc_full_path is not None
             if not dsmc_exists:
                 error_msg = "DSMC utility not found, yo! Specify the right path in LentochkaDSMC.ini"
                 dsmc_log.log_manager.error(error_msg)
@@ -673,71 +790,71 @@ def main():
                 sys.exit(1)
             successful_copies = 0
             failed_copies = 0
-            for stanza in stanzas:
-                dsmc_log.log_manager.info(f"Processing stanza: {stanza['repo_path']}...")
-                if stanza_processor.process_stanza(stanza):
-                    successful_copies += 1
-                    if monitoring.enabled:
-                        monitoring.send_metric("processed_stanzas", 1)
-                else:
-                    failed_copies += 1
-                    if monitoring.enabled:
-                        monitoring.send_metric("failed_stanzas", 1)
+            with ThreadPoolExecutor(max_workers=max(stanza_processor.stanza_workers, 1)) as pool:
+                futures = []
+                for stanza in stanza_processor.iter_stanzas():
+                    dsmc_log.log_manager.info("Processing stanza: %s...", stanza['repo_path'])
+                    futures.append(pool.submit(stanza_processor.process_stanza, stanza))
+                for future in as_completed(futures):
+                    if future.result():
+                        successful_copies += 1
+                    else:
+                        failed_copies += 1
+            if monitoring.enabled:
+                monitoring.send_metric("processed_stanzas", successful_copies)
+                monitoring.send_metric("failed_stanzas", failed_copies)
             dsmc_log.log_manager.info(
-                f"Results: Processed {len(stanzas)} stanzas, "
+                f"Results: Processed {len(futures)} stanzas, "
                 f"successfully copied: {successful_copies}, errors: {failed_copies}"
             )
             dsmc_log.cleanup_empty_logs()
             dsmc_log.close_iteration_log()
 
-            if dsmc_log.lentochka_status_dir and os.path.exists(dsmc_log.lentochka_status_dir):
+            if dsmc_log.lentochka_status_dir:
                 try:
                     if not os.listdir(dsmc_log.lentochka_status_dir):
                         os.rmdir(dsmc_log.lentochka_status_dir)
                         dsmc_log.log_manager.info(
                             f"Removed empty lentochka_status_dir: {dsmc_log.lentochka_status_dir}")
+                except FileNotFoundError:
+                    pass
                 except Exception as e:
                     dsmc_log.log_manager.error(f"Error removing empty lentochka_status_dir: {e}")
 
             if monitoring.log_cleanup_enabled:
-                log_dir = dsmc_log.config.get('Paths', 'log_dir')
+                log_dir = monitoring.log_dir
                 if not log_dir:
                     dsmc_log.log_manager.warning("No log_dir specified, skipping cleanup, yo!")
                 else:
                     monitoring.cleanup_logs(log_dir, monitoring.log_retention_days)
+            monitoring.flush_metrics()
             dsmc_log.log_manager.info("Script has completed successfully, hell yeah!")
     except FileNotFoundError as e:
         print(f"File not found: {e}, damn!")
-        if dsmc_log and hasattr(dsmc_log, 'log_manager'):
-            dsmc_log.log_manager.error(f"File not found: {e}")
+        log_manager.error(f"File not found: {e}")
         if monitoring and monitoring.enabled:
             try:
                 monitoring.send_metric("script_error", 1, "ERROR")
             except Exception as send_error:
-                if dsmc_log and hasattr(dsmc_log, 'log_manager'):
-                    dsmc_log.log_manager.error(f"Error sending metric for FileNotFoundError: {send_error}")
+                log_manager.error(f"Error sending metric for FileNotFoundError: {send_error}")
         sys.exit(1)
     except ValueError as e:
         print(f"Value error: {e}, shit!")
-        if dsmc_log and hasattr(dsmc_log, 'log_manager'):
-            dsmc_log.log_manager.error(f"Value error: {e}")
+        log_manager.error(f"Value error: {e}")
         if monitoring and monitoring.enabled:
             try:
                 monitoring.send_metric("script_error", 1, "ERROR")
             except Exception as send_error:
-                if dsmc_log and hasattr(dsmc_log, 'log_manager'):
-                    dsmc_log.log_manager.error(f"Error sending metric for ValueError: {send_error}")
+                log_manager.error(f"Error sending metric for ValueError: {send_error}")
         sys.exit(1)
     except Exception as e:
         print(f"Unexpected error: {e}, yo!")
-        if dsmc_log and hasattr(dsmc_log, 'log_manager'):
-            dsmc_log.log_manager.error(f"Unexpected error: {e}")
+        log_manager.error(f"Unexpected error: {e}")
         if monitoring and monitoring.enabled:
             try:
                 monitoring.send_metric("script_error", 1, "ERROR")
             except Exception as send_error:
-                if dsmc_log and hasattr(dsmc_log, 'log_manager'):
-                    dsmc_log.log_manager.error(f"Error sending metric for unexpected error: {send_error}")
+                log_manager.error(f"Error sending metric for unexpected error: {send_error}")
         sys.exit(1)
 if __name__ == '__main__':
     main()
@@ -12,7 +12,6 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     install_requires=[
-        'psutil',
         'configparser',
     ],
     classifiers=[